@@ -1,446 +1,732 @@
-import os
-import hashlib
-import threading
-import time
-from datetime import datetime
-import logging # 로깅 모듈 추가
-
-import pytz
-import gspread
-from flask import Flask
-from oauth2client.service_account import ServiceAccountCredentials # type: ignore
-from dotenv import load_dotenv
-import telebot # type: ignore
-from gspread.exceptions import APIError
-import re # re 모듈 추가
-
-# ─────── MarkdownV2 이스케이프 헬퍼 함수 ──────────────
-def escape_markdownv2(text):
-    """
-    MarkdownV2에서 예약된 문자를 이스케이프 처리합니다.
-    """
-    if text is None:
-        return ''
-    text = str(text)
-    # MarkdownV2에서 예약된 모든 문자 목록
-    # _, *, [, ], (, ), ~, `, >, #, +, -, =, |, {, }, ., !
-    # 정규 표현식을 사용하여 이 문자들을 찾고 앞에 '\'를 붙여줍니다.
-    # '['나 ']' 같은 문자는 정규식 패턴 안에서 특별한 의미를 가질 수 있으므로 패턴 자체를 raw string으로 사용하거나 이중 이스케이프가 필요할 수 있습니다.
-    # 여기서는 간단하게 각 문자에 대해 replace 하는 방식을 사용합니다.
-    # 더 견고한 처리를 위해 re.sub을 사용할 수도 있습니다.
-    
-    # 간단한 replace 방식 (일부 복잡한 경우에 문제될 수 있으나 대부분의 이름/문장에서 작동)
-    # for char in r'_*[]()~`>#+-=|{}.!':
-    #    text = text.replace(char, f'\\{char}')
-    # return text
-
-    # re.sub 방식 (더 강력)
-    # 패턴 내에서 정규식 특별 문자는 이스케이프 해줘야 합니다 (\, [, ], (, ), {, }, |, ., +, *, ?, ^, $).
-    # 우리는 예약 문자 자체를 찾는 패턴을 만듭니다.
-    reserved_chars_pattern = r'([_*\[\]()~`>#\+\-=\|\{\}\.!])'
-    # 찾은 각 문자를 '\'와 그 문자(\1)로 치환
-    return re.sub(reserved_chars_pattern, r'\\\1', text)
-
-# ─── 로깅 설정 ────────────────────────────────────────────────────────────────
-# 기본 로깅 레벨은 INFO, 필요시 DEBUG로 변경하여 더 자세한 로그 확인 가능
-logging.basicConfig(
-    level=logging.INFO, # INFO 레벨 이상 로그 출력 (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__) # 현재 모듈에 대한 로거 생성
-
-# ─── 환경 변수 로드 ────────────────────────────────────────────────────────────
-load_dotenv()
-SPREADSHEET_URL = os.getenv("SPREADSHEET_URL")
-SPREADSHEET_NAME = os.getenv("SPREADSHEET_NAME", "Sheet1")
-BASE_TOKEN      = os.getenv("TELEGRAM_TOKEN")
-PORT            = int(os.getenv("PORT", 5000))
-
-# ─── Flask 앱 (헬스체크) ────────────────────────────────────────────────────────
-app = Flask(__name__)
-
-@app.route("/", methods=["GET"])
-def root():
-    logger.info("Health check '/' endpoint called.")
-    return "OK", 200
-
-@app.route("/ping", methods=["GET"])
-def ping():
-    logger.info("Health check '/ping' endpoint called.")
-    return "pong", 200
-
-@app.route("/favicon.ico")
-def favicon():
-    return "", 204
-
-# ─── 시간대 설정 ───────────────────────────────────────────────────────────────
-KST = pytz.timezone("Asia/Seoul")
-
-# ─── 캐시 변수 ─────────────────────────────────────────────────────────────────
-last_sheet_hash = None
-welcome_list    = []  # 입장 시 환영 메시지
-schedule_list   = []  # 요일·시간 스케줄
-
-# ─── 헬퍼 함수 ─────────────────────────────────────────────────────────────────
-def get_sheet_hash(values):
-    flat_list = []
-    for row in values:
-        for item in row:
-            flat_list.append(str(item)) # 모든 아이템을 문자열로 변환하여 일관성 유지
-    flat_string = "".join(flat_list)
-    return hashlib.md5(flat_string.encode('utf-8')).hexdigest()
-
-
-def convert_weekday_kor_to_eng(kor):
-    m = {
-        "월요일": "monday", "화요일": "tuesday", "수요일": "wednesday",
-        "목요일": "thursday", "금요일": "friday", "토요일": "saturday",
-        "일요일": "sunday", "입장시": "on_join"
-    }
-    return m.get(str(kor).strip(), "").lower() # 입력값을 문자열로 변환 후 처리
-
-# ─── 시트 데이터 로드 & 캐싱 (예외 처리 포함) ─────────────────────────────────
-def load_configs():
-    global last_sheet_hash, welcome_list, schedule_list
-    logger.info("[LOAD_CONFIGS] 설정 로드 시도...")
-
-    if not SPREADSHEET_URL or not BASE_TOKEN:
-        logger.error("[LOAD_CONFIGS] SPREADSHEET_URL 또는 TELEGRAM_TOKEN 환경변수가 설정되지 않았습니다.")
-        return
-
-    try:
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        # google_credentials.json 파일이 현재 작업 디렉토리에 있어야 함
-        # Render 등에서는 Secret File 기능을 사용하여 업로드하고 경로를 지정해야 할 수 있음
-        creds_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "google_credentials.json")
-        if not os.path.exists(creds_path):
-            logger.error(f"[LOAD_CONFIGS] Google Credentials 파일({creds_path})을 찾을 수 없습니다.")
-            return
-
-        creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-        client = gspread.authorize(creds)
-
-        spreadsheet = client.open_by_url(SPREADSHEET_URL)
-        sheet = spreadsheet.worksheet(SPREADSHEET_NAME)
-
-        values = sheet.get_all_values() # 시트 전체 값 가져오기 (헤더 포함)
-        current_hash = get_sheet_hash(values)
-
-        if current_hash == last_sheet_hash:
-            logger.info("[LOAD_CONFIGS] 시트 내용 변경 없음. 기존 설정 사용.")
-            return
-
-        logger.info(f"[LOAD_CONFIGS] 시트 변경 감지 (이전 해시: {last_sheet_hash}, 새 해시: {current_hash}). 설정 다시 로드 중...")
-        last_sheet_hash = current_hash
-
-        data = sheet.get_all_records() # 헤더를 키로 사용하는 딕셔너리 리스트 반환
-        
-        # 리스트 초기화 전에 임시 리스트 사용 (오류 발생 시 이전 데이터 유지 목적)
-        temp_welcome_list = []
-        temp_schedule_list = []
-
-        for row_num, row in enumerate(data, start=2): # start=2 (헤더 제외한 실제 데이터 행 번호)
-            try:
-                # 필수 컬럼 확인
-                send_day_raw = row.get("보낼 요일")
-                group_id_raw = row.get("그룹방 ID")
-                message_raw = row.get("보낼 메세지")
-
-                if send_day_raw is None or group_id_raw is None or message_raw is None:
-                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: 필수 컬럼('보낼 요일', '그룹방 ID', '보낼 메세지') 중 누락된 값이 있어 건너<0xEB><0xA9>니다: {row}")
-                    continue
-                
-                wd = convert_weekday_kor_to_eng(send_day_raw)
-                if not wd: # 변환 실패 시 (예: 오타)
-                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '보낼 요일' 값('{send_day_raw}')을 변환할 수 없습니다. 건너<0xEB><0xA9>니다.")
-                    continue
-
-                try:
-                    # 그룹방 ID는 보통 음수이므로, 문자열 처리 시 주의
-                    chat_id_str = str(group_id_raw).strip()
-                    if not chat_id_str.startswith("-100") and chat_id_str.isdigit():
-                         cid = int("-100" + chat_id_str)
-                    else:
-                         cid = int(chat_id_str) # 이미 -100으로 시작하거나 다른 형식의 ID일 경우 그대로 사용
-                except ValueError:
-                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '그룹방 ID' 값('{group_id_raw}')을 정수로 변환할 수 없습니다. 건너<0xEB><0xA9>니다.")
-                    continue
-                
-                tid_raw = row.get("토픽 ID", "0") # 기본값을 문자열 "0"으로
-                try:
-                    tid = int(str(tid_raw).strip()) if str(tid_raw).strip() else 0
-                except ValueError:
-                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '토픽 ID' 값('{tid_raw}')을 정수로 변환할 수 없습니다. 기본값 0을 사용합니다.")
-                    tid = 0
-                
-                msg = str(message_raw) # 메시지는 항상 문자열로
-                send_time_raw = row.get("보낼 시간", "").strip()
-
-                if wd == "on_join":
-                    temp_welcome_list.append({
-                        "chat_id": cid,
-                        "topic_id": tid,
-                        "message": msg,
-                        "row_num": row_num # 디버깅용 행 번호 추가
-                    })
-                else:
-                    if not send_time_raw: # 예약 메시지인데 시간이 없으면
-                        logger.warning(f"[LOAD_CONFIGS] {row_num}행: 예약 메시지({wd})에 '보낼 시간'이 지정되지 않았습니다. 건너<0xEB><0xA9>니다.")
-                        continue
-                    temp_schedule_list.append({
-                        "weekday": wd,
-                        "time": send_time_raw,
-                        "chat_id": cid,
-                        "topic_id": tid,
-                        "message": msg,
-                        "row_num": row_num # 디버깅용 행 번호 추가
-                    })
-            except Exception as e:
-                logger.error(f"[LOAD_CONFIGS] {row_num}행 데이터 처리 중 예기치 않은 오류 발생: {row}, 오류: {e}", exc_info=True)
-
-
-        welcome_list = temp_welcome_list
-        schedule_list = temp_schedule_list
-
-        logger.info(f"[LOAD_CONFIGS] 로드된 환영 메시지 수: {len(welcome_list)}")
-        if welcome_list:
-            logger.debug(f"[LOAD_CONFIGS] 첫번째 환영 메시지 예시: {welcome_list[0]}")
-        logger.info(f"[LOAD_CONFIGS] 로드된 스케줄 수: {len(schedule_list)}")
-        if schedule_list:
-            logger.debug(f"[LOAD_CONFIGS] 첫번째 스케줄 예시: {schedule_list[0]}")
-
-    except APIError as e:
-        logger.warning(f"[LOAD_CONFIGS] Google Sheets APIError: {e}. 다음 주기에 재시도합니다.")
-    except Exception as e:
-        logger.error(f"[LOAD_CONFIGS] 설정 로드 중 심각한 오류 발생: {e}", exc_info=True)
-
-
-# ─── TeleBot 생성 & 환영 핸들러 등록 ───────────────────────────────────────────
-if not BASE_TOKEN:
-    logger.critical("TELEGRAM_TOKEN 환경 변수가 설정되지 않았습니다. 봇을 시작할 수 없습니다.")
-    # 여기서 프로그램을 종료하거나, 적절한 오류 처리를 해야 합니다.
-    # 예: exit(1) 또는 raise ValueError(...)
-    # 지금은 다음 코드가 실행되지 않도록 bot 객체 생성을 조건부로 만듭니다.
-    bot = None
-else:
-    bot = telebot.TeleBot(BASE_TOKEN, threaded=False)
-
-
-if bot: # bot 객체가 성공적으로 생성된 경우에만 핸들러 등록
-    @bot.message_handler(content_types=['new_chat_members'])
-    def handle_new_members(message):
-        if not message.new_chat_members:
-            return
-
-        logger.info(f"[NEW_MEMBER] 채팅 ID {message.chat.id} 에 새 멤버 {len(message.new_chat_members)}명 감지.")
-        for new_user in message.new_chat_members:
-            user_info = f"{new_user.first_name}"
-            if new_user.last_name:
-                user_info += f" {new_user.last_name}"
-            if new_user.username:
-                user_info += f" (@{new_user.username})"
-
-            logger.info(f"[NEW_MEMBER] 처리 중인 새 멤버: {user_info} (ID: {new_user.id})")
-
-            for cfg_idx, cfg in enumerate(welcome_list):
-                if message.chat.id == cfg["chat_id"]:
-                    logger.debug(f"[NEW_MEMBER] 채팅 ID {message.chat.id}에 대한 환영 설정 {cfg_idx} (원본 행: {cfg.get('row_num', 'N/A')}) 발견.")
-                    try:
-                        # 메시지에 사용자 이름 적용 (format 방식 대신 f-string 유사 방식 고려)
-                        # 단순 new_user 객체 전체를 format에 넘기면 오류 발생 가능성이 높음
-                        # 필요한 속성만 명시적으로 사용: {new_user.first_name}, {new_user.username} 등
-                        # 여기서는 간단히 {new_user} 플레이스홀더를 사용자 이름으로 대체
-                        personalized_message = cfg["message"].replace("{new_user}", user_info)
-                        # 만약 시트에 {new_user.first_name} 같은 구체적인 형식을 쓴다면,
-                        # personalized_message = cfg["message"].format(new_user=new_user) # 와 같이 사용 가능
-                        # 다만, new_user 객체에 해당 속성이 없을 경우 오류 발생하므로 주의
-                        
-                    except Exception as e:
-                        logger.error(f"[NEW_MEMBER] 메시지 포맷팅 중 오류 (설정 행: {cfg.get('row_num', 'N/A')}): {e}", exc_info=True)
-                        personalized_message = cfg["message"]  # 실패 시 원본 메시지
-
-                    kwargs = {
-                        "chat_id": cfg["chat_id"],
-                        "text": personalized_message
-                    }
-                    # topic_id가 유효한 값일 때 (보통 1 이상, 0이나 None은 아님)
-                    if cfg["topic_id"] and cfg["topic_id"] not in [0, 1]: # 1도 General 토픽으로 간주될 수 있으므로 제외
-                        kwargs["message_thread_id"] = cfg["topic_id"]
-                    
-                    try:
-                        logger.info(f"[NEW_MEMBER] 환영 메시지 전송 시도: ChatID={cfg['chat_id']}, TopicID={kwargs.get('message_thread_id', 'N/A')}, User={user_info}")
-                        sent_msg = bot.send_message(**kwargs)
-                        logger.info(f"[NEW_MEMBER] 환영 메시지 전송 성공: MsgID={sent_msg.message_id}, 내용='{personalized_message[:30]}...'")
-                    except Exception as e:
-                        logger.error(f"[NEW_MEMBER] 환영 메시지 전송 실패 (설정 행: {cfg.get('row_num', 'N/A')}): {e}", exc_info=True)
-
-# --- get_my_user_id 함수 수정 ---
-# 기존 get_my_user_id 함수를 찾아서 내부 내용만 아래와 같이 수정합니다.
-
-if bot: # 텔레그램 봇 객체가 있는지 다시 한번 확인
-    @bot.message_handler(commands=['myid', 'getid', '나의아이디']) # 'myid', 'getid', '나의아이디' 명령어에 반응
-    def get_my_user_id(message):
-        """
-        사용자의 User ID를 알려주는 핸들러
-        """
-        user_id = message.from_user.id
-        first_name = message.from_user.first_name
-        last_name = message.from_user.last_name
-        username = message.from_user.username
-
-        logger.info(f"사용자 {first_name} (ID: {user_id}) 로부터 /myid 명령어 수신.")
-
-        # 사용자 이름, 성 등 MarkdownV2 예약 문자가 포함될 수 있는 부분을 이스케이프 처리
-        # User ID(숫자)는 이스케이프 불필요
-        # username의 '@'는 @username 형식에서는 예약 문자가 아닙니다.
-        escaped_first_name = escape_markdownv2(first_name) if first_name else ''
-        escaped_last_name = escape_markdownv2(last_name) if last_name else ''
-        # username 자체에 _ 등이 있다면 이스케이프 필요하지만, (@username) 포맷에서는 보통 문제되지 않음.
-        # 여기서는 username 자체를 이스케이프하지 않고 포맷에 넣습니다.
-
-
-        # 응답 메시지 텍스트 구성
-        # **굵게** 와 `코드` 문법은 그대로 두고, 문장 끝의 마침표(`.`)는 '\.'로 이스케이프합니다.
-        # 사용자 이름 등 변수 자리에는 이스케이프된 내용을 넣습니다.
-        response_text_main = f"**{escaped_first_name}** 님의 텔레그램 User ID는 `{user_id}` 입니다\." # 마지막 '.' 이스케이프
-
-        # 추가 정보 (선택 사항) 구성
-        user_info_parts_formatted = []
-        if escaped_last_name:
-            user_info_parts_formatted.append(escaped_last_name)
-        if username:
-            # @username 형식은 그대로 사용 (username 자체에 _ 등이 있다면 문제가 될 수 있으나 일반적으론 괜찮음)
-            user_info_parts_formatted.append(f"(@{username})")
-
-        # 최종 메시지 텍스트 조합
-        if user_info_parts_formatted:
-             final_response_text = response_text_main + " " + " ".join(user_info_parts_formatted)
-        else:
-             final_response_text = response_text_main
-
-
-        logger.debug(f"구성된 응답 메시지 (MarkdownV2): {final_response_text}")
-
-
-        try:
-            # 1. 사용자에게 개인 메시지로 ID 보내기 (우선 시도, 프라이버시 보호)
-            # MarkdownV2를 사용하므로 이스케이프된 final_response_text 사용
-            bot.send_message(message.from_user.id, final_response_text, parse_mode='MarkdownV2')
-            logger.info(f"User ID {user_id}를 개인 메시지로 성공적으로 전송했습니다.")
-
-            # 명령어가 그룹에서 사용되었다면, 그룹에는 확인 메시지만 보냅니다.
-            if message.chat.id != message.from_user.id:
-                 try:
-                     # 그룹 확인 메시지는 MarkdownV2 예약 문자가 포함되지 않도록 간단하게 작성
-                     bot.send_message(message.chat.id, f"{first_name} 님의 User ID를 개인 메시지로 보내드렸습니다.", reply_to_message_id=message.message_id)
-                     logger.debug(f"그룹 {message.chat.id}에 User ID 개인 메시지 발송 확인 메시지 전송.")
-                 except Exception as e_group_ack:
-                     logger.error(f"그룹 {message.chat.id}에 확인 메시지 전송 실패: {e_group_ack}", exc_info=True)
-
-        except Exception as e_private_send:
-            # 2. 개인 메시지 전송 실패 시 (사용자가 봇에게 먼저 말을 걸지 않은 경우 등)
-            logger.warning(f"User ID {user_id}에게 개인 메시지 전송 실패: {e_private_send}. 대신 채팅방 {message.chat.id}으로 전송 시도.")
-            try:
-                # 명령어가 온 원래 채팅방 (그룹 또는 개인)으로 메시지 전송
-                # 이 라인이 traceback에 표시된 라인이며, 여기서도 MarkdownV2를 사용하므로 이스케이프된 텍스트가 필수입니다.
-                bot.send_message(message.chat.id, final_response_text, parse_mode='MarkdownV2', reply_to_message_id=message.message_id)
-                logger.info(f"User ID {user_id}를 채팅방 {message.chat.id}으로 대신 전송 성공.")
-            except Exception as e_group_send:
-                 logger.error(f"User ID {user_id}를 채팅방 {message.chat.id}으로 대신 전송 최종 실패: {e_group_send}", exc_info=True)
-
-# -------------------------------------
-
-
-
-# ─── 스케줄러 헬퍼 & 루프 ───────────────────────────────────────────────────────
-def sleep_until_next_minute():
-    now = datetime.now()
-    # 다음 분 0초까지 남은 시간 계산 (마이크로초까지 고려)
-    sleep_duration = 60 - now.second - (now.microsecond / 1_000_000.0)
-    if sleep_duration < 0: # 이미 다음 분으로 넘어간 경우 (거의 발생 안함)
-        sleep_duration += 60
-    
-    # 로깅 추가: 얼마나 대기하는지 확인
-    logger.debug(f"[SCHEDULER_SLEEP] 다음 분까지 {sleep_duration:.2f}초 대기합니다.")
-    if sleep_duration > 0:
-        time.sleep(sleep_duration)
-
-
-def scheduler_loop():
-    logger.info("[SCHEDULER] 스케줄러 루프 시작.")
-    initial_load_done = False # 초기 로딩 플래그
-
-    while True:
-        try: # 스케줄러 루프 전체를 try-except로 감싸서 에러 발생 시 로깅하고 계속 실행되도록
-            if not initial_load_done or (datetime.now(KST).minute % 5 == 0): # 첫 실행 시 또는 매 5분마다 로드
-                logger.info("[SCHEDULER] 설정 로드 실행 (최초 또는 5분 주기).")
-                load_configs()
-                initial_load_done = True
-            
-            now_kst = datetime.now(KST)
-            current_weekday = now_kst.strftime("%A").lower() # 예: "monday"
-            current_time_hm = now_kst.strftime("%H:%M")     # 예: "09:30"
-
-            logger.info(f"[SCHEDULER] 현재 시간(KST): {now_kst.strftime('%Y-%m-%d %H:%M:%S %Z%z')}, 요일: {current_weekday}, 시간(HM): {current_time_hm}")
-
-            if not schedule_list:
-                logger.info("[SCHEDULER] 실행할 스케줄이 없습니다.")
-            else:
-                logger.debug(f"[SCHEDULER] 등록된 스케줄 {len(schedule_list)}개 확인 중...")
-
-            for cfg_idx, cfg in enumerate(schedule_list):
-                # 로그 레벨을 DEBUG로 설정해야 보임
-                logger.debug(f"[SCHEDULER_CHECK] 스케줄 확인 중 (설정 행: {cfg.get('row_num', 'N/A')}): 시트값(요일:{cfg['weekday']}, 시간:{cfg['time']}) vs 현재값(요일:{current_weekday}, 시간:{current_time_hm})")
-                
-                if cfg["weekday"] == current_weekday and cfg["time"] == current_time_hm:
-                    logger.info(f"[SCHEDULER_TRIGGER] 조건 일치! (설정 행: {cfg.get('row_num', 'N/A')}) 메시지 전송 시도: {cfg}")
-                    try:
-                        kwargs = {
-                            "chat_id": cfg["chat_id"],
-                            "text": cfg["message"]
-                        }
-                        if cfg["topic_id"] and cfg["topic_id"] not in [0, 1]:
-                            kwargs["message_thread_id"] = cfg["topic_id"]
-                        
-                        logger.info(f"[SCHEDULER_SENDING] 예약 메시지 전송 시도: ChatID={cfg['chat_id']}, TopicID={kwargs.get('message_thread_id', 'N/A')}, 내용='{cfg['message'][:30]}...'")
-                        sent_msg = bot.send_message(**kwargs)
-                        logger.info(f"[SCHEDULER_SENT] 예약 메시지 전송 성공: MsgID={sent_msg.message_id}")
-                    except Exception as e:
-                        logger.error(f"[SCHEDULER_ERROR] 예약 메시지 전송 실패 (설정 행: {cfg.get('row_num', 'N/A')}): {e}", exc_info=True)
-            
-            sleep_until_next_minute()
-
-        except Exception as e:
-            logger.error(f"[SCHEDULER_FATAL] 스케줄러 루프에서 예기치 않은 심각한 오류 발생: {e}", exc_info=True)
-            logger.info("[SCHEDULER_FATAL] 1분 후 스케줄러 루프 재시도합니다.")
-            time.sleep(60) # 심각한 오류 시 잠시 대기 후 재시도
-
-
-# ─── 앱 실행 ───────────────────────────────────────────────────────────────────
-if __name__ == "__main__":
-    if not bot:
-        logger.critical("텔레그램 봇 토큰이 없어 봇을 실행할 수 없습니다. 환경 변수를 확인하세요.")
-        exit(1) # 프로그램 종료
-
-    logger.info("Flask 앱 및 스케줄러 스레드 시작 중...")
-    # 1) Flask 헬스체크 서버 (데몬 스레드)
-    flask_thread = threading.Thread(target=lambda: app.run(host="0.0.0.0", port=PORT, debug=False), daemon=True)
-    flask_thread.start()
-    logger.info(f"Flask 앱이 0.0.0.0:{PORT} 에서 실행됩니다.")
-
-    # 2) 스케줄러 (데몬 스레드)
-    scheduler_thread = threading.Thread(target=scheduler_loop, daemon=True)
-    scheduler_thread.start()
-    logger.info("스케줄러 스레드가 시작되었습니다.")
-
-    # 3) Telegram Polling (메인 스레드에서 실행, 블로킹)
-    logger.info("텔레그램 봇 폴링 시작 (무한 대기)...")
-    try:
-        bot.delete_webhook(drop_pending_updates=True) # 기존 웹훅 제거 및 대기중인 업데이트 삭제
-        logger.info("기존 웹훅 제거 완료.")
-        bot.infinity_polling(logger_level=logging.INFO, timeout=20, long_polling_timeout=10) # 타임아웃 설정 추가
-    except Exception as e:
-        logger.critical(f"텔레그램 봇 폴링 중 심각한 오류 발생: {e}", exc_info=True)
-    finally:
-        logger.info("텔레그램 봇 폴링이 종료되었습니다.")
+import functools
+import os
+import hashlib
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from datetime import datetime
+import logging # 로깅 모듈 추가
+
+import pytz
+import gspread
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask, request
+from waitress import serve # 프로덕션 WSGI 서버 (Werkzeug 개발 서버 대체)
+from oauth2client.service_account import ServiceAccountCredentials # type: ignore
+from dotenv import load_dotenv
+import telebot # type: ignore
+from gspread.exceptions import APIError
+
+# ─────── MarkdownV2 이스케이프 헬퍼 함수 ──────────────
+# MarkdownV2에서 예약된 모든 문자 목록
+# _, *, [, ], (, ), ~, `, >, #, +, -, =, |, {, }, ., !
+# 고정된 문자 집합의 치환이므로 정규식이 필요 없음. str.translate는 C 레벨
+# 단일 패스로 처리되어 Match 객체 할당도 없이 컴파일된 정규식보다 빠름.
+_MDV2_ESCAPE_TABLE = str.maketrans({c: '\\' + c for c in r'_*[]()~`>#+-=|{}.!'})
+
+def escape_markdownv2(text):
+    """
+    MarkdownV2에서 예약된 문자를 이스케이프 처리합니다.
+    """
+    if text is None:
+        return ''
+    return str(text).translate(_MDV2_ESCAPE_TABLE)
+
+# ─── 로깅 설정 ────────────────────────────────────────────────────────────────
+# 기본 로깅 레벨은 INFO, 필요시 DEBUG로 변경하여 더 자세한 로그 확인 가능
+logging.basicConfig(
+    level=logging.INFO, # INFO 레벨 이상 로그 출력 (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__) # 현재 모듈에 대한 로거 생성
+
+# ─── 환경 변수 로드 ────────────────────────────────────────────────────────────
+load_dotenv()
+SPREADSHEET_URL = os.getenv("SPREADSHEET_URL")
+SPREADSHEET_NAME = os.getenv("SPREADSHEET_NAME", "Sheet1")
+BASE_TOKEN      = os.getenv("TELEGRAM_TOKEN")
+PORT            = int(os.getenv("PORT", 5000))
+# 웹훅 모드 설정: PUBLIC_URL이 설정되면 폴링 대신 웹훅으로 업데이트를 받음
+# (예: Render의 외부 URL "https://my-bot.onrender.com")
+PUBLIC_URL      = os.getenv("PUBLIC_URL", "").rstrip("/")
+# 웹훅 경로/헤더 검증용 시크릿. 미설정 시 토큰에서 유도 (토큰 자체를 URL에 노출하지 않기 위함)
+WEBHOOK_SECRET  = os.getenv("WEBHOOK_SECRET") or (
+    hashlib.sha256(BASE_TOKEN.encode()).hexdigest()[:32] if BASE_TOKEN else ""
+)
+
+# ─── Flask 앱 (헬스체크) ────────────────────────────────────────────────────────
+app = Flask(__name__)
+
+# /ping은 업타임 모니터가 1분마다 영원히 호출하는 경로.
+# URL 라우팅·뷰 디스패치·응답 객체 생성·INFO 로그를 전부 생략하고
+# WSGI 계층에서 미리 만들어 둔 바이트로 즉시 응답 (나머지 경로는 Flask로 위임).
+_HEALTH_RESPONSES = {
+    "/ping": ("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "4")], [b"pong"]),
+    "/":     ("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "2")], [b"OK"]),
+}
+
+def _health_shortcut(environ, start_response, _flask_app=app.wsgi_app):
+    # 업타임 모니터는 GET뿐 아니라 HEAD로도 찔러봄 — Flask의 GET 라우트가
+    # 자동 제공하던 HEAD(헤더 동일, 본문 없음)와 같은 동작을 유지
+    method = environ.get("REQUEST_METHOD")
+    if method in ("GET", "HEAD"):
+        hit = _HEALTH_RESPONSES.get(environ.get("PATH_INFO", ""))
+        if hit is not None:
+            start_response(hit[0], hit[1])
+            return hit[2] if method == "GET" else [b""]
+        if environ.get("PATH_INFO") == "/favicon.ico":
+            start_response("204 No Content", [("Content-Length", "0")])
+            return [b""]
+    return _flask_app(environ, start_response)
+
+app.wsgi_app = _health_shortcut
+
+# ─── 시간대 설정 ───────────────────────────────────────────────────────────────
+KST = pytz.timezone("Asia/Seoul")
+
+# ─── 캐시 변수 ─────────────────────────────────────────────────────────────────
+last_sheet_hash    = None
+last_modified_time = None  # Drive가 알려주는 시트 수정 시각 (저렴한 변경 감지용)
+# 설정 스냅샷 전체를 하나의 불변 객체로 묶어 참조 한 번으로 교체.
+# 필드를 따로따로 rebind하면 읽는 쪽이 환영/스케줄이 서로 다른 세대인
+# 비일관 상태를 관찰할 수 있지만, 단일 참조 교체는 CPython에서 원자적.
+Config = namedtuple("Config", ["welcome_list", "schedule_list", "welcome_by_chat", "schedule_index", "version"])
+#  welcome_list    : 입장 시 환영 메시지 (불변 튜플)
+#  schedule_list   : 요일·시간 스케줄 (불변 튜플)
+#  welcome_by_chat : chat_id -> (환영 설정, ...) — 입장 이벤트 O(1) 디스패치용
+#  schedule_index  : (weekday_int, hour, minute) -> (스케줄 설정, ...) — 틱 O(1) 조회용
+_CONFIG = Config((), (), {}, {}, 0)
+
+# 5분 주기 무조건 재로드 대신, '시트가 바뀌었을 수 있음' 신호가 올 때만 로드.
+# Drive 푸시 웹훅(/drive-hook)이 세우고, 안전망으로 30분마다 타이머가 세움.
+config_dirty = threading.Event()
+config_dirty.set()  # 기동 직후 최초 로드 강제
+_CONFIG_REFRESH_FALLBACK_SEC = 30 * 60
+
+# SIGTERM/SIGINT 수신 시 세워지는 종료 플래그. time.sleep과 달리 Event.wait는
+# 플래그가 세워지면 즉시 반환하므로 최대 60초씩 종료가 지연되는 일이 없음.
+_STOP = threading.Event()
+
+# ─── 헬퍼 함수 ─────────────────────────────────────────────────────────────────
+def get_sheet_hash(values):
+    # 시트 전체를 하나의 거대한 문자열로 이어붙인 뒤 해시하면 시트 크기만큼의
+    # 임시 할당이 두 번 생김. 행 단위로 해시 객체에 스트리밍하면 중간 문자열
+    # 없이 한 번의 패스로 끝남. 셀/행 구분자(\x1f, \x1e)를 넣어 셀 경계가
+    # 달라졌을 때 해시가 우연히 같아지는 일을 방지.
+    # 변경 감지 용도이므로 암호학적 강도 불필요 — 64비트면 단일 시트 상태 비교에
+    # 충돌 확률이 무시할 수준이고, 다이제스트 생성·보관·비교 모두 가벼워짐
+    h = hashlib.blake2b(digest_size=8)
+    for row in values:
+        h.update("\x1f".join(str(item) for item in row).encode('utf-8'))
+        h.update(b"\x1e")
+    return h.digest()
+
+
+# 행마다 dict를 새로 만들 필요가 없도록 변환 테이블은 모듈 로드 시 한 번만 구성
+# (값이 이미 전부 소문자이므로 조회 후 .lower()도 불필요)
+_WEEKDAY_KOR_TO_ENG = {
+    "월요일": "monday", "화요일": "tuesday", "수요일": "wednesday",
+    "목요일": "thursday", "금요일": "friday", "토요일": "saturday",
+    "일요일": "sunday", "입장시": "on_join"
+}
+
+# 시트가 커져도 같은 값이 수백 번 반복되므로 lru_cache로 str()/strip() 재수행을 생략
+@functools.lru_cache(maxsize=32)
+def convert_weekday_kor_to_eng(kor):
+    return _WEEKDAY_KOR_TO_ENG.get(str(kor).strip(), "") # 입력값을 문자열로 변환 후 처리
+
+
+def _compile_row_parser(header):
+    """
+    현재 헤더의 열 위치에 특화된 행 파서 함수를 생성합니다 (부분 평가).
+    행마다 dict(zip(...)) 구성 + row.get(...) 5회 대신 고정 인덱스 접근만 수행.
+    반환: parse(row) -> (보낼 요일, 그룹방 ID, 토픽 ID, 보낼 메세지, 보낼 시간)
+    """
+    required = ("보낼 요일", "그룹방 ID", "보낼 메세지")
+    missing = [col for col in required if col not in header]
+    if missing:
+        raise ValueError(f"시트 헤더에 필수 컬럼이 없습니다: {missing}")
+
+    def cell_expr(col, default):
+        # get_all_values의 행은 뒤쪽 빈 셀이 잘려 헤더보다 짧을 수 있으므로 길이 가드 포함
+        if col not in header:
+            return repr(default)
+        i = header.index(col)
+        return f"(r[{i}] if len(r) > {i} else {default!r})"
+
+    src = "def parse(r):\n    return ({}, {}, {}, {}, {})".format(
+        cell_expr("보낼 요일", ""),
+        cell_expr("그룹방 ID", ""),
+        cell_expr("토픽 ID", "0"),
+        cell_expr("보낼 메세지", ""),
+        cell_expr("보낼 시간", ""),
+    )
+    ns = {}
+    exec(src, ns)  # 헤더가 바뀌는 것은 리로드 시점뿐이므로 리로드당 1회만 컴파일
+    return ns["parse"]
+
+
+@functools.lru_cache(maxsize=1024)
+def _to_chat_id(raw):
+    """시트의 '그룹방 ID' 값을 텔레그램 chat_id 정수로 변환합니다."""
+    # gspread가 숫자 셀을 int로 줄 때의 빠른 경로: 음수면 이미 완성된 chat_id
+    if isinstance(raw, int):
+        return raw if raw < 0 else int("-100" + str(raw))
+    # 그룹방 ID는 보통 음수이므로, 문자열 처리 시 주의
+    chat_id_str = str(raw).strip()
+    if not chat_id_str.startswith("-100") and chat_id_str.isdigit():
+        return int("-100" + chat_id_str)
+    return int(chat_id_str) # 이미 -100으로 시작하거나 다른 형식의 ID일 경우 그대로 사용
+
+# datetime.weekday() 규약과 동일 (월=0 ... 일=6). 틱 비교를 정수로 하기 위한 테이블.
+_WEEKDAY_TO_INT = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+    "friday": 4, "saturday": 5, "sunday": 6
+}
+
+# ─── Google Sheets 연결 캐시 ───────────────────────────────────────────────────
+# 인증서 파일 읽기 + JSON 파싱 + OAuth 서명자 생성 + authorize + open_by_url은
+# 전부 상수 작업이므로 한 번만 수행하고 재사용. 인증 오류 시에만 재구축.
+_gs_cache = {"client": None, "spreadsheet": None, "sheet": None}
+
+def _get_sheet():
+    """
+    캐시된 (spreadsheet, worksheet)를 반환합니다. 캐시가 비어 있으면
+    인증부터 다시 수행하여 채웁니다. 실패 시 예외를 그대로 전파합니다.
+    """
+    if _gs_cache["sheet"] is not None:
+        return _gs_cache["spreadsheet"], _gs_cache["sheet"]
+
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    # google_credentials.json 파일이 현재 작업 디렉토리에 있어야 함
+    # Render 등에서는 Secret File 기능을 사용하여 업로드하고 경로를 지정해야 할 수 있음
+    creds_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "google_credentials.json")
+    if not os.path.exists(creds_path):
+        raise FileNotFoundError(f"Google Credentials 파일({creds_path})을 찾을 수 없습니다.")
+
+    creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
+    client = gspread.authorize(creds)
+    spreadsheet = client.open_by_url(SPREADSHEET_URL)
+    sheet = spreadsheet.worksheet(SPREADSHEET_NAME)
+
+    _gs_cache["client"] = client
+    _gs_cache["spreadsheet"] = spreadsheet
+    _gs_cache["sheet"] = sheet
+    logger.info("[SHEETS] Google Sheets 연결 생성 및 캐시 완료.")
+    return spreadsheet, sheet
+
+def _invalidate_sheet_cache():
+    """인증/연결 오류 후 다음 시도에서 재연결되도록 캐시를 비웁니다."""
+    _gs_cache["client"] = None
+    _gs_cache["spreadsheet"] = None
+    _gs_cache["sheet"] = None
+
+
+# ─── 시트 데이터 로드 & 캐싱 (예외 처리 포함) ─────────────────────────────────
+def load_configs():
+    global last_sheet_hash, _CONFIG
+    logger.info("[LOAD_CONFIGS] 설정 로드 시도...")
+
+    if not SPREADSHEET_URL or not BASE_TOKEN:
+        logger.error("[LOAD_CONFIGS] SPREADSHEET_URL 또는 TELEGRAM_TOKEN 환경변수가 설정되지 않았습니다.")
+        return
+
+    try:
+        try:
+            spreadsheet, sheet = _get_sheet()
+        except FileNotFoundError as e:
+            logger.error(f"[LOAD_CONFIGS] {e}")
+            return
+
+        # 전체 시트를 내려받기 전에 Drive 메타데이터(수정 시각)만 먼저 조회.
+        # 응답이 수백 바이트라 전체 fetch 대비 매우 저렴하며, 시트가 그대로면
+        # 여기서 바로 반환하여 Sheets API 호출·해시 계산을 모두 건너뜀.
+        global last_modified_time
+        try:
+            modified_time = spreadsheet.lastUpdateTime
+            if modified_time and modified_time == last_modified_time:
+                logger.info("[LOAD_CONFIGS] Drive 수정 시각 변경 없음. 기존 설정 사용.")
+                return
+        except (AttributeError, APIError) as e:
+            # 구버전 gspread이거나 Drive 메타 조회 실패 시 기존 해시 방식으로 폴백
+            logger.debug("[LOAD_CONFIGS] Drive 수정 시각 조회 실패, 해시 비교로 폴백: %s", e)
+            modified_time = None
+
+        values = sheet.get_all_values() # 시트 전체 값 가져오기 (헤더 포함)
+        current_hash = get_sheet_hash(values)
+
+        if current_hash == last_sheet_hash:
+            logger.info("[LOAD_CONFIGS] 시트 내용 변경 없음. 기존 설정 사용.")
+            last_modified_time = modified_time  # 다음 주기에는 메타 조회만으로 끝나도록 갱신
+            return
+
+        # digest()는 raw bytes이므로 로그에는 hex로 출력 (최초 로드 시 이전 해시는 None)
+        logger.info(f"[LOAD_CONFIGS] 시트 변경 감지 (이전 해시: {last_sheet_hash.hex() if last_sheet_hash else None}, 새 해시: {current_hash.hex()}). 설정 다시 로드 중...")
+        last_sheet_hash = current_hash
+        last_modified_time = modified_time
+
+        # get_all_records()를 다시 호출하면 같은 데이터를 한 번 더 내려받게 됨.
+        # 해시 계산에 쓴 values를 그대로 재사용 — API 호출 1회 절약.
+        if not values:
+            logger.warning("[LOAD_CONFIGS] 시트가 비어 있습니다.")
+            return
+        # 헤더는 리로드 내내 고정이므로 열 위치에 특화된 파서를 1회 생성해
+        # 행마다 dict 구성 없이 원시 리스트에서 바로 값을 뽑음
+        try:
+            parse_row = _compile_row_parser(values[0])
+        except ValueError as e:
+            logger.error(f"[LOAD_CONFIGS] {e}")
+            return
+
+        # 리스트 초기화 전에 임시 리스트 사용 (오류 발생 시 이전 데이터 유지 목적)
+        temp_welcome_list = []
+        temp_schedule_list = []
+
+        for row_num, row in enumerate(values[1:], start=2): # start=2 (헤더 제외한 실제 데이터 행 번호)
+            try:
+                send_day_raw, group_id_raw, tid_raw, message_raw, send_time_raw = parse_row(row)
+
+                # 필수 값 확인 (빈 셀은 '')
+                if not send_day_raw or not group_id_raw or not message_raw:
+                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: 필수 컬럼('보낼 요일', '그룹방 ID', '보낼 메세지') 중 누락된 값이 있어 건너<0xEB><0xA9>니다: {row}")
+                    continue
+                
+                wd = convert_weekday_kor_to_eng(send_day_raw)
+                if not wd: # 변환 실패 시 (예: 오타)
+                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '보낼 요일' 값('{send_day_raw}')을 변환할 수 없습니다. 건너<0xEB><0xA9>니다.")
+                    continue
+
+                try:
+                    cid = _to_chat_id(group_id_raw)
+                except ValueError:
+                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '그룹방 ID' 값('{group_id_raw}')을 정수로 변환할 수 없습니다. 건너<0xEB><0xA9>니다.")
+                    continue
+                
+                try:
+                    tid = int(str(tid_raw).strip()) if str(tid_raw).strip() else 0
+                except ValueError:
+                    logger.warning(f"[LOAD_CONFIGS] {row_num}행: '토픽 ID' 값('{tid_raw}')을 정수로 변환할 수 없습니다. 기본값 0을 사용합니다.")
+                    tid = 0
+                
+                msg = str(message_raw) # 메시지는 항상 문자열로
+                send_time_raw = str(send_time_raw).strip()
+
+                # 전송 시 그대로 **로 펼칠 kwargs를 여기서 확정해 두면 핸들러/틱에서는
+                # 토픽 유효성 분기나 dict 조립 없이 바로 발송 큐에 넘길 수 있음
+                send_kwargs = {"chat_id": cid}
+                if tid and tid not in (0, 1): # 1도 General 토픽으로 간주될 수 있으므로 제외
+                    send_kwargs["message_thread_id"] = tid
+
+                if wd == "on_join":
+                    temp_welcome_list.append({
+                        "chat_id": cid,
+                        "topic_id": tid,
+                        "message": msg,
+                        # {new_user} 자리에서 미리 분할해 두면 전송 시 join 한 번으로 끝남.
+                        # 플레이스홀더가 없으면 한 조각짜리 튜플이라 join이 원문을 그대로 반환.
+                        "tmpl": tuple(msg.split("{new_user}")),
+                        "send_kwargs": send_kwargs,  # text는 전송 시점에 채움
+                        "row_num": row_num # 디버깅용 행 번호 추가
+                    })
+                else:
+                    if not send_time_raw: # 예약 메시지인데 시간이 없으면
+                        logger.warning(f"[LOAD_CONFIGS] {row_num}행: 예약 메시지({wd})에 '보낼 시간'이 지정되지 않았습니다. 건너<0xEB><0xA9>니다.")
+                        continue
+                    try:
+                        # 틱마다 문자열 비교/strftime을 하지 않도록 정수 슬롯으로 미리 파싱
+                        hh, mm = map(int, send_time_raw.split(":"))
+                        if not (0 <= hh <= 23 and 0 <= mm <= 59):
+                            raise ValueError(send_time_raw)
+                    except ValueError:
+                        logger.warning(f"[LOAD_CONFIGS] {row_num}행: '보낼 시간' 값('{send_time_raw}')을 HH:MM 형식으로 해석할 수 없습니다. 건너뜁니다.")
+                        continue
+                    temp_schedule_list.append({
+                        "weekday": wd,
+                        "time": send_time_raw,
+                        "slot": (_WEEKDAY_TO_INT[wd], hh, mm),
+                        "chat_id": cid,
+                        "topic_id": tid,
+                        "message": msg,
+                        "send_kwargs": dict(send_kwargs, text=msg),  # 발송 인자 완성본
+                        "row_num": row_num # 디버깅용 행 번호 추가
+                    })
+            except Exception as e:
+                logger.error(f"[LOAD_CONFIGS] {row_num}행 데이터 처리 중 예기치 않은 오류 발생: {row}, 오류: {e}", exc_info=True)
+
+
+        # 핫패스(입장 이벤트·분당 틱)에서 선형 탐색 대신 해시 조회가 되도록 인덱스 구성
+        temp_welcome_by_chat = {}
+        for cfg in temp_welcome_list:
+            temp_welcome_by_chat.setdefault(cfg["chat_id"], []).append(cfg)
+        temp_schedule_index = {}
+        for cfg in temp_schedule_list:
+            temp_schedule_index.setdefault(cfg["slot"], []).append(cfg)
+
+        # 다른 스레드(텔레그램 핸들러·스케줄러)가 순회 중일 수 있으므로
+        # 제자리 수정 대신 완성된 불변 스냅샷 하나를 만들어 참조 한 번으로 교체.
+        # (튜플은 순회 중 변형될 수 없고, 단일 rebind라 읽는 쪽에 락이 필요 없음)
+        _CONFIG = Config(
+            welcome_list=tuple(temp_welcome_list),
+            schedule_list=tuple(temp_schedule_list),
+            welcome_by_chat={k: tuple(v) for k, v in temp_welcome_by_chat.items()},
+            schedule_index={k: tuple(v) for k, v in temp_schedule_index.items()},
+            version=_CONFIG.version + 1,
+        )
+
+        logger.info(f"[LOAD_CONFIGS] 로드된 환영 메시지 수: {len(_CONFIG.welcome_list)} (설정 v{_CONFIG.version})")
+        if _CONFIG.welcome_list:
+            logger.debug("[LOAD_CONFIGS] 첫번째 환영 메시지 예시: %s", _CONFIG.welcome_list[0])
+        logger.info(f"[LOAD_CONFIGS] 로드된 스케줄 수: {len(_CONFIG.schedule_list)}")
+        if _CONFIG.schedule_list:
+            logger.debug("[LOAD_CONFIGS] 첫번째 스케줄 예시: %s", _CONFIG.schedule_list[0])
+
+    except APIError as e:
+        logger.warning(f"[LOAD_CONFIGS] Google Sheets APIError: {e}. 연결 캐시를 비우고 다음 주기에 재시도합니다.")
+        _invalidate_sheet_cache()  # 만료된 토큰/끊긴 연결일 수 있으므로 다음 시도에서 재인증
+    except Exception as e:
+        logger.error(f"[LOAD_CONFIGS] 설정 로드 중 심각한 오류 발생: {e}", exc_info=True)
+        _invalidate_sheet_cache()
+
+
+# ─── TeleBot 생성 & 환영 핸들러 등록 ───────────────────────────────────────────
+if not BASE_TOKEN:
+    logger.critical("TELEGRAM_TOKEN 환경 변수가 설정되지 않았습니다. 봇을 시작할 수 없습니다.")
+    # 여기서 프로그램을 종료하거나, 적절한 오류 처리를 해야 합니다.
+    # 예: exit(1) 또는 raise ValueError(...)
+    # 지금은 다음 코드가 실행되지 않도록 bot 객체 생성을 조건부로 만듭니다.
+    bot = None
+else:
+    # threaded=False는 업데이트 디스패치를 직렬화함 — 발송은 전용 풀이 담당하므로
+    # 핸들러 자체는 telebot 기본 워커 스레드에서 병렬 처리되게 둠.
+    bot = telebot.TeleBot(BASE_TOKEN)
+    # pyTelegramBotAPI는 호출 시마다 새 HTTPS 연결을 열 수 있어 send_message마다
+    # TLS 핸드셰이크(~100ms)를 다시 지불함. keep-alive 커넥션 풀이 있는 Session을
+    # 주입해 api.telegram.org와의 TLS 터널을 재사용.
+    _tg_session = requests.Session()
+    _tg_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    telebot.apihelper._get_req_session = lambda: _tg_session
+
+
+if bot: # bot 객체가 성공적으로 생성된 경우에만 핸들러 등록
+    @bot.message_handler(content_types=['new_chat_members'])
+    def handle_new_members(message):
+        if not message.new_chat_members:
+            return
+
+        logger.info(f"[NEW_MEMBER] 채팅 ID {message.chat.id} 에 새 멤버 {len(message.new_chat_members)}명 감지.")
+        for new_user in message.new_chat_members:
+            user_info = f"{new_user.first_name}"
+            if new_user.last_name:
+                user_info += f" {new_user.last_name}"
+            if new_user.username:
+                user_info += f" (@{new_user.username})"
+
+            logger.info(f"[NEW_MEMBER] 처리 중인 새 멤버: {user_info} (ID: {new_user.id})")
+
+            # 스냅샷 참조를 한 번만 읽어 두면 처리 도중 리로드가 일어나도 일관성 유지
+            for cfg in _CONFIG.welcome_by_chat.get(message.chat.id, ()):
+                logger.debug("[NEW_MEMBER] 채팅 ID %s에 대한 환영 설정 (원본 행: %s) 발견.", message.chat.id, cfg.get('row_num', 'N/A'))
+                # {new_user} 플레이스홀더 자리는 로드 시점에 이미 분할되어 있으므로
+                # 매 전송마다 전체 메시지를 스캔하는 replace 대신 join 한 번이면 됨.
+                # (잘못될 입력이 없어 try/except 경로도 불필요)
+                personalized_message = user_info.join(cfg["tmpl"])
+
+                # 토픽 유효성 분기는 로드 시 send_kwargs에 반영 완료 — text만 채우면 됨
+                kwargs = dict(cfg["send_kwargs"], text=personalized_message)
+                logger.info(f"[NEW_MEMBER] 환영 메시지 발송 큐 등록: ChatID={cfg['chat_id']}, TopicID={kwargs.get('message_thread_id', 'N/A')}, User={user_info}")
+                enqueue_send(kwargs, origin=f"환영(행 {cfg.get('row_num', 'N/A')})")
+
+# --- get_my_user_id 함수 수정 ---
+# 기존 get_my_user_id 함수를 찾아서 내부 내용만 아래와 같이 수정합니다.
+
+if bot: # 텔레그램 봇 객체가 있는지 다시 한번 확인
+    @bot.message_handler(commands=['myid', 'getid', '나의아이디']) # 'myid', 'getid', '나의아이디' 명령어에 반응
+    def get_my_user_id(message):
+        """
+        사용자의 User ID를 알려주는 핸들러
+        """
+        user_id = message.from_user.id
+        first_name = message.from_user.first_name
+        last_name = message.from_user.last_name
+        username = message.from_user.username
+
+        logger.info(f"사용자 {first_name} (ID: {user_id}) 로부터 /myid 명령어 수신.")
+
+        # 사용자 이름, 성 등 MarkdownV2 예약 문자가 포함될 수 있는 부분을 이스케이프 처리
+        # User ID(숫자)는 이스케이프 불필요
+        # username의 '@'는 @username 형식에서는 예약 문자가 아닙니다.
+        escaped_first_name = escape_markdownv2(first_name) if first_name else ''
+        escaped_last_name = escape_markdownv2(last_name) if last_name else ''
+        # username 자체에 _ 등이 있다면 이스케이프 필요하지만, (@username) 포맷에서는 보통 문제되지 않음.
+        # 여기서는 username 자체를 이스케이프하지 않고 포맷에 넣습니다.
+
+
+        # 응답 메시지 텍스트 구성
+        # **굵게** 와 `코드` 문법은 그대로 두고, 문장 끝의 마침표(`.`)는 '\.'로 이스케이프합니다.
+        # 사용자 이름 등 변수 자리에는 이스케이프된 내용을 넣습니다.
+        response_text_main = f"**{escaped_first_name}** 님의 텔레그램 User ID는 `{user_id}` 입니다\." # 마지막 '.' 이스케이프
+
+        # 추가 정보 (선택 사항) 구성
+        user_info_parts_formatted = []
+        if escaped_last_name:
+            user_info_parts_formatted.append(escaped_last_name)
+        if username:
+            # @username 형식은 그대로 사용 (username 자체에 _ 등이 있다면 문제가 될 수 있으나 일반적으론 괜찮음)
+            user_info_parts_formatted.append(f"(@{username})")
+
+        # 최종 메시지 텍스트 조합
+        if user_info_parts_formatted:
+             final_response_text = response_text_main + " " + " ".join(user_info_parts_formatted)
+        else:
+             final_response_text = response_text_main
+
+
+        logger.debug("구성된 응답 메시지 (MarkdownV2): %s", final_response_text)
+
+
+        try:
+            # 1. 사용자에게 개인 메시지로 ID 보내기 (우선 시도, 프라이버시 보호)
+            # MarkdownV2를 사용하므로 이스케이프된 final_response_text 사용
+            bot.send_message(message.from_user.id, final_response_text, parse_mode='MarkdownV2')
+            logger.info(f"User ID {user_id}를 개인 메시지로 성공적으로 전송했습니다.")
+
+            # 명령어가 그룹에서 사용되었다면, 그룹에는 확인 메시지만 보냅니다.
+            if message.chat.id != message.from_user.id:
+                 try:
+                     # 그룹 확인 메시지는 MarkdownV2 예약 문자가 포함되지 않도록 간단하게 작성
+                     bot.send_message(message.chat.id, f"{first_name} 님의 User ID를 개인 메시지로 보내드렸습니다.", reply_to_message_id=message.message_id)
+                     logger.debug("그룹 %s에 User ID 개인 메시지 발송 확인 메시지 전송.", message.chat.id)
+                 except Exception as e_group_ack:
+                     logger.error(f"그룹 {message.chat.id}에 확인 메시지 전송 실패: {e_group_ack}", exc_info=True)
+
+        except Exception as e_private_send:
+            # 2. 개인 메시지 전송 실패 시 (사용자가 봇에게 먼저 말을 걸지 않은 경우 등)
+            logger.warning(f"User ID {user_id}에게 개인 메시지 전송 실패: {e_private_send}. 대신 채팅방 {message.chat.id}으로 전송 시도.")
+            try:
+                # 명령어가 온 원래 채팅방 (그룹 또는 개인)으로 메시지 전송
+                # 이 라인이 traceback에 표시된 라인이며, 여기서도 MarkdownV2를 사용하므로 이스케이프된 텍스트가 필수입니다.
+                bot.send_message(message.chat.id, final_response_text, parse_mode='MarkdownV2', reply_to_message_id=message.message_id)
+                logger.info(f"User ID {user_id}를 채팅방 {message.chat.id}으로 대신 전송 성공.")
+            except Exception as e_group_send:
+                 logger.error(f"User ID {user_id}를 채팅방 {message.chat.id}으로 대신 전송 최종 실패: {e_group_send}", exc_info=True)
+
+# -------------------------------------
+
+
+# ─── 텔레그램 웹훅 엔드포인트 ──────────────────────────────────────────────────
+if bot:
+    @app.route(f"/tg/{WEBHOOK_SECRET}", methods=["POST"])
+    def telegram_webhook():
+        """
+        텔레그램이 푸시하는 업데이트를 받아 봇 핸들러로 전달합니다.
+        폴링 대신 웹훅을 사용하면 업데이트가 HTTP 푸시 한 번으로 도착합니다.
+        """
+        # set_webhook 시 지정한 secret_token 헤더 검증 (경로 시크릿과 이중 방어)
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return "forbidden", 403
+        # Flask의 get_json()은 MIME 검사·캐싱 계층을 거침. 원문 바이트를 바로
+        # de_json에 넘기면 (C로 구현된 stdlib json으로) 한 번만 파싱하고 끝.
+        update = telebot.types.Update.de_json(request.get_data(as_text=True))
+        bot.process_new_updates([update])
+        return "", 200
+
+
+# ─── Drive 변경 알림 웹훅 ──────────────────────────────────────────────────────
+@app.route("/drive-hook", methods=["POST"])
+def drive_hook():
+    """
+    Google Drive files.watch 채널이 시트 변경 시 POST하는 엔드포인트.
+    본문은 쓰지 않고 재로드 플래그만 세워 다음 틱에 load_configs가 실행되게 함.
+    """
+    logger.info("[DRIVE_HOOK] Drive 변경 알림 수신, 설정 재로드 예약.")
+    config_dirty.set()
+    return "", 200
+
+
+def _periodic_config_refresh():
+    # Drive 채널이 만료되거나 알림이 유실될 경우를 대비한 안전망.
+    config_dirty.set()
+    t = threading.Timer(_CONFIG_REFRESH_FALLBACK_SEC, _periodic_config_refresh)
+    t.daemon = True
+    t.start()
+
+
+# ─── 발송 풀 ───────────────────────────────────────────────────────────────────
+# 같은 분에 N건이 겹치면 단일 워커로는 N×RTT가 걸림. 작은 스레드 풀로 전송을
+# 겹치게 하되, 전역 페이싱(~30 msg/s)과 방별 락(같은 방 안에서의 순서 유지)은 지킴.
+_SEND_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tg-send")
+_SEND_MIN_INTERVAL = 1.0 / 30  # 텔레그램 전역 약 30 msg/s 한도
+_CHAT_MIN_INTERVAL = 1.0       # 같은 방 기준 약 1 msg/s 한도
+_send_rate_lock = threading.Lock()
+_last_send_at = 0.0
+# chat_id -> [방별 락, 해당 방 마지막 전송 시각(monotonic)]
+_chat_states = {}
+_chat_locks_guard = threading.Lock()
+
+def enqueue_send(kwargs, origin="N/A"):
+    """발송 요청을 풀에 제출합니다. kwargs는 bot.send_message 인자 그대로."""
+    _SEND_POOL.submit(_send_one, kwargs, origin)
+
+def _send_one(kwargs, origin):
+    global _last_send_at
+    # 같은 방으로 가는 메시지는 방별 락으로 직렬화 (제출 순서 유지)
+    with _chat_locks_guard:
+        state = _chat_states.setdefault(kwargs.get("chat_id"), [threading.Lock(), 0.0])
+    with state[0]:
+        # 방별 한도 준수: 같은 방 직전 전송 이후 최소 1초 간격 유지
+        # (전역 간격만으로는 같은 분에 겹친 같은 방 메시지가 ~33ms 간격으로
+        #  나가 방별 ~1 msg/s 한도에 걸려 429를 유발함)
+        wait = state[1] + _CHAT_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        # 전역 한도 준수를 위한 최소 간격 유지
+        with _send_rate_lock:
+            wait = _last_send_at + _SEND_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            _last_send_at = time.monotonic()
+        try:
+            sent_msg = bot.send_message(**kwargs)
+            logger.info(f"[SEND_POOL] 메시지 전송 성공 (origin={origin}): MsgID={sent_msg.message_id}")
+        except Exception as e:
+            logger.error(f"[SEND_POOL] 메시지 전송 실패 (origin={origin}): {e}", exc_info=True)
+        finally:
+            state[1] = time.monotonic()  # 성공/실패 무관하게 방별 간격 기준 갱신
+
+
+# ─── 스케줄러 헬퍼 & 루프 ───────────────────────────────────────────────────────
+_MINUTES_PER_WEEK = 7 * 1440
+
+def seconds_until_next_slot(now_kst):
+    """
+    현재 시각 이후 가장 가까운 스케줄 슬롯(해당 분의 0초)까지 남은 초를 계산합니다.
+    등록된 스케줄이 없으면 None. 현재 분의 슬롯은 이미 처리된 것으로 간주합니다.
+    """
+    schedule_index = _CONFIG.schedule_index  # 스냅샷 참조 1회 읽기
+    if not schedule_index:
+        return None
+    now_min = now_kst.weekday() * 1440 + now_kst.hour * 60 + now_kst.minute  # 주 내 분 위치
+    best = _MINUTES_PER_WEEK
+    for wd, hh, mm in schedule_index:
+        delta = (wd * 1440 + hh * 60 + mm - now_min) % _MINUTES_PER_WEEK
+        if delta == 0:
+            delta = _MINUTES_PER_WEEK  # 같은 슬롯은 다음 주
+        if delta < best:
+            best = delta
+    return best * 60 - now_kst.second - now_kst.microsecond / 1_000_000.0
+
+
+def scheduler_loop():
+    logger.info("[SCHEDULER] 스케줄러 루프 시작.")
+    # 마지막으로 발송한 슬롯. config_dirty로 같은 분 안에 다시 깨어나도
+    # (예: /drive-hook POST, 안전망 타이머) 동일 슬롯을 중복 발송하지 않기 위함.
+    last_fired_slot = None
+
+    while not _STOP.is_set():
+        try: # 스케줄러 루프 전체를 try-except로 감싸서 에러 발생 시 로깅하고 계속 실행되도록
+            # 5분마다 무조건 로드하는 대신, 변경 신호(웹훅/안전망 타이머)가 있을 때만 로드
+            if config_dirty.is_set():
+                config_dirty.clear()
+                logger.info("[SCHEDULER] 설정 변경 신호 감지, 설정 로드 실행.")
+                load_configs()
+
+            now_kst = datetime.now(KST)
+            # strftime 문자열 생성 없이 정수 필드로 현재 슬롯 구성 (월=0 ... 일=6)
+            current_slot = (now_kst.weekday(), now_kst.hour, now_kst.minute)
+
+            # 이미 처리한 분에 신호로 다시 깨어난 경우 발송을 건너뜀 (중복 방지)
+            slot_configs = ()
+            if current_slot != last_fired_slot:
+                slot_configs = _CONFIG.schedule_index.get(current_slot, ())
+                last_fired_slot = current_slot
+
+            # (요일, 시, 분) 정수 키로 해당 슬롯의 설정만 조회 (스냅샷 참조 1회 읽기)
+            for cfg in slot_configs:
+                logger.info(f"[SCHEDULER_TRIGGER] 조건 일치! (설정 행: {cfg.get('row_num', 'N/A')}) 메시지 전송 시도: {cfg}")
+                try:
+                    # 발송 인자는 로드 시 send_kwargs로 완성되어 있어 조립 없이 바로 큐에 등록
+                    logger.info(f"[SCHEDULER_SENDING] 예약 메시지 발송 큐 등록: ChatID={cfg['chat_id']}, TopicID={cfg['send_kwargs'].get('message_thread_id', 'N/A')}, 내용='{cfg['message'][:30]}...'")
+                    enqueue_send(cfg["send_kwargs"], origin=f"예약(행 {cfg.get('row_num', 'N/A')})")
+                except Exception as e:
+                    logger.error(f"[SCHEDULER_ERROR] 예약 메시지 큐 등록 실패 (설정 행: {cfg.get('row_num', 'N/A')}): {e}", exc_info=True)
+
+            # 분마다 깨어나 확인하는 대신, 다음 이벤트까지 곧장 수면:
+            #  - 다음 스케줄 슬롯의 0초 시각, 또는
+            #  - 설정 변경 신호(config_dirty)가 깨우는 시점 (웹훅/안전망 타이머)
+            # 스케줄이 전혀 없으면 변경 신호가 올 때까지 대기.
+            wait_sec = seconds_until_next_slot(datetime.now(KST))
+            if wait_sec is None:
+                wait_sec = _CONFIG_REFRESH_FALLBACK_SEC
+            logger.debug("[SCHEDULER_SLEEP] 다음 이벤트까지 %.2f초 대기합니다.", wait_sec)
+            config_dirty.wait(timeout=max(wait_sec, 0.5))
+
+        except Exception as e:
+            logger.error(f"[SCHEDULER_FATAL] 스케줄러 루프에서 예기치 않은 심각한 오류 발생: {e}", exc_info=True)
+            logger.info("[SCHEDULER_FATAL] 1분 후 스케줄러 루프 재시도합니다.")
+            _STOP.wait(timeout=60) # 심각한 오류 시 잠시 대기 후 재시도 (종료 신호에는 즉시 반응)
+
+    logger.info("[SCHEDULER] 종료 신호로 스케줄러 루프를 마칩니다.")
+
+
+# ─── 앱 실행 ───────────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    if not bot:
+        logger.critical("텔레그램 봇 토큰이 없어 봇을 실행할 수 없습니다. 환경 변수를 확인하세요.")
+        exit(1) # 프로그램 종료
+
+    # 종료 신호 처리: 수면 중인 스케줄러도 즉시 깨워 깨끗하게 종료되도록 함
+    def _handle_shutdown(signum, frame):
+        logger.info(f"종료 신호({signum}) 수신, 정리 후 종료합니다.")
+        _STOP.set()
+        config_dirty.set()  # wait 중인 스케줄러를 즉시 깨움
+        # 핸들러는 메인 스레드에서 실행되므로 SystemExit가 serve/폴링 루프를
+        # 뚫고 올라가 프로세스가 실제로 종료됨 (플래그만 세우면 메인 루프가 계속 돎)
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, _handle_shutdown)
+    signal.signal(signal.SIGINT, _handle_shutdown)
+
+    logger.info("스케줄러 스레드 시작 중...")
+    # 0) 설정 재로드 안전망 타이머 (Drive 알림 유실 대비)
+    _periodic_config_refresh()
+
+    # 1) 스케줄러 (데몬 스레드) — 발송 자체는 _SEND_POOL 스레드 풀이 처리
+    scheduler_thread = threading.Thread(target=scheduler_loop, daemon=True)
+    scheduler_thread.start()
+    logger.info("스케줄러 스레드가 시작되었습니다.")
+
+    if PUBLIC_URL:
+        # 2-a) 웹훅 모드: Flask 서버가 프로세스의 메인 루프가 되고,
+        #      텔레그램 업데이트는 /tg/<secret> 으로 푸시됨 (폴링 스레드 불필요)
+        webhook_url = f"{PUBLIC_URL}/tg/{WEBHOOK_SECRET}"
+        try:
+            bot.remove_webhook()
+            bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET, drop_pending_updates=True)
+            logger.info(f"웹훅 등록 완료: {PUBLIC_URL}/tg/<secret>")
+        except Exception as e:
+            logger.critical(f"웹훅 등록 실패: {e}", exc_info=True)
+            exit(1)
+
+        # Werkzeug 개발 서버는 단일 스레드 Python 루프라 요청마다 GIL을 길게 잡음.
+        # waitress는 C 확장 없이도 멀티스레드로 동작하는 프로덕션 WSGI 서버.
+        logger.info(f"waitress(웹훅 수신)가 0.0.0.0:{PORT} 에서 실행됩니다.")
+        serve(app, host="0.0.0.0", port=PORT, threads=8)
+    else:
+        # 2-b) 폴링 모드 (PUBLIC_URL 미설정 시 폴백): 기존 동작 유지
+        logger.warning("PUBLIC_URL이 설정되지 않아 웹훅 대신 폴링 모드로 실행합니다.")
+        flask_thread = threading.Thread(target=lambda: serve(app, host="0.0.0.0", port=PORT, threads=2), daemon=True)
+        flask_thread.start()
+        logger.info(f"waitress(헬스체크)가 0.0.0.0:{PORT} 에서 실행됩니다.")
+
+        logger.info("텔레그램 봇 폴링 시작 (무한 대기)...")
+        try:
+            bot.delete_webhook(drop_pending_updates=True) # 기존 웹훅 제거 및 대기중인 업데이트 삭제
+            logger.info("기존 웹훅 제거 완료.")
+            bot.infinity_polling(logger_level=logging.INFO, timeout=20, long_polling_timeout=10) # 타임아웃 설정 추가
+        except Exception as e:
+            logger.critical(f"텔레그램 봇 폴링 중 심각한 오류 발생: {e}", exc_info=True)
+        finally:
+            logger.info("텔레그램 봇 폴링이 종료되었습니다.")
@@ -36,20 +36,21 @@ def greet_new_member(message):
         )
         bot.send_message(message.chat.id, welcome_message)
 
+# 공지 내용은 실행 시점과 무관한 고정 문자열이므로 모듈 상수로 한 번만 구성
+_WEEKLY_ANNOUNCEMENT = (
+    "☘비즈LIKE 모임 취합☘\n\n"
+    "참석자/재료준비(개인or공구)/사진부/재료비 입금\n"
+    "예)임정민/공구/0/0\n\n"
+    "1/\n"
+    "2/\n"
+    "3/\n"
+    "4/\n\n"
+    "‼️수다방 고정 메세지 필수 확인‼️\n"
+)
+
 # 매주 월요일 오전 9시 (한국 시간) 공지 전송 함수
 def weekly_announcement():
-    now = datetime.now(KST).strftime("%Y-%m-%d")
-    message = (
-         f"☘비즈LIKE 모임 취합☘\n\n"
-         f"참석자/재료준비(개인or공구)/사진부/재료비 입금\n"
-         f"예)임정민/공구/0/0\n\n"
-         f"1/\n"
-         f"2/\n"
-         f"3/\n"
-         f"4/\n\n"
-         f"‼️수다방 고정 메세지 필수 확인‼️\n"
-    )
-    bot.send_message(chat_id=CHAT_ID, text=message, message_thread_id=TOPIC2_ID)  # 공지 전용 토픽
+    bot.send_message(chat_id=CHAT_ID, text=_WEEKLY_ANNOUNCEMENT, message_thread_id=TOPIC2_ID)  # 공지 전용 토픽
 
 # 한국 시간 기준으로 월요일 9시에 공지를 보내는 스케줄러
 KST = pytz.timezone("Asia/Seoul")